@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+csr_graph.py
+
+Compact array form of the derived graph, for sharing between processes.
+
+A pickled networkx.Graph carries shapely geometries and whole pandas.Series
+on every edge, and each worker of a process pool would have to unpickle its
+own copy. CSRGraph keeps only the connectivity, in compressed sparse row
+(CSR) form, plus numeric node and edge attributes as flat numpy arrays. The
+arrays can be placed in one shared-memory block, or saved as .npy files and
+memory-mapped, and workers attach to them without copying.
+
+Typical use with a process pool:
+
+    csr = CSRGraph.from_networkx(G)
+    shm, manifest = csr.to_shared_memory()
+    with ProcessPoolExecutor(initializer=init_worker, initargs=(manifest,)) as ex:
+        ...                           # workers call CSRGraph.attach(manifest)
+    shm.close(); shm.unlink()
+
+Unrelated processes can attach too, with CSRGraph.attach(manifest,
+pool_worker=False).
+
+"""
+
+import json
+import sys
+from multiprocessing import shared_memory, resource_tracker
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+
+NODE_ATTRS = ['kv', 'phases', 'ica_pv', 'ica_load']
+EDGE_ATTRS = ['length', 'weight', 'section_id', 'phases', 'kv', 'ica_pv', 'ica_load']
+
+_ALIGN = 64 # byte alignment of each array in a shared block
+
+
+class CSRGraph:
+    '''
+    Undirected graph as CSR adjacency arrays plus numeric attribute arrays.
+
+    Nodes are numbered 0..n-1 (node_ids holds the original ids) and edges
+    0..m-1 (edge_src/edge_dst hold their endpoints). The neighbors of node i
+    are indices[indptr[i]:indptr[i+1]], reached via edges
+    edge_index[indptr[i]:indptr[i+1]].
+
+    Node attributes are stored as 'node:<name>' arrays (including 'node:x'
+    and 'node:y' from 'pos') and edge attributes as 'edge:<name>' arrays.
+    Missing values are NaN.
+
+    '''
+
+    def __init__(self, arrays, shm=None):
+        self.arrays = arrays
+        self._shm = shm # keeps an attached shared-memory block alive
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @property
+    def node_ids(self):
+        return self.arrays['node_ids']
+
+    @property
+    def indptr(self):
+        return self.arrays['indptr']
+
+    @property
+    def indices(self):
+        return self.arrays['indices']
+
+    @property
+    def edge_index(self):
+        return self.arrays['edge_index']
+
+    @property
+    def n_nodes(self):
+        return len(self.arrays['node_ids'])
+
+    @property
+    def n_edges(self):
+        return len(self.arrays['edge_src'])
+
+    def neighbors(self, i):
+        '''Internal indices of the neighbors of internal node i'''
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def node_attr(self, name):
+        return self.arrays['node:' + name]
+
+    def edge_attr(self, name):
+        return self.arrays['edge:' + name]
+
+    @classmethod
+    def from_networkx(cls, G, node_attrs=NODE_ATTRS, edge_attrs=EDGE_ATTRS):
+        '''
+        Parameters
+        ----------
+        G : networkx.Graph
+            Electrical graph (tree_builder output)
+        node_attrs, edge_attrs : list of str
+            Numeric attributes to export; anything missing becomes NaN
+
+        '''
+
+        node_ids = np.array(list(G.nodes))
+        loc = pd.Series(np.arange(len(node_ids)), index=node_ids)
+        arrays = {'node_ids': node_ids}
+
+        pos = nx.get_node_attributes(G, 'pos')
+        xy = pd.DataFrame.from_dict(pos, orient='index', columns=['x', 'y'])
+        xy = xy.reindex(node_ids)
+        arrays['node:x'] = xy['x'].to_numpy(dtype=float)
+        arrays['node:y'] = xy['y'].to_numpy(dtype=float)
+        for name in node_attrs:
+            vals = pd.Series(nx.get_node_attributes(G, name), dtype=float)
+            arrays['node:' + name] = vals.reindex(node_ids).to_numpy()
+
+        edges = nx.to_pandas_edgelist(G)
+        src = loc[edges['source']].to_numpy() if len(edges) else np.zeros(0, dtype=np.int64)
+        dst = loc[edges['target']].to_numpy() if len(edges) else np.zeros(0, dtype=np.int64)
+        arrays['edge_src'] = src
+        arrays['edge_dst'] = dst
+        for name in edge_attrs:
+            col = edges[name] if name in edges else pd.Series(np.nan, index=edges.index)
+            arrays['edge:' + name] = pd.to_numeric(col, errors='coerce').to_numpy(dtype=float)
+
+        # Each edge appears in both rows, self-loops once
+        eid = np.arange(len(src))
+        both = src != dst
+        rows = np.concatenate([src, dst[both]])
+        cols = np.concatenate([dst, src[both]])
+        eidx = np.concatenate([eid, eid[both]])
+        order = np.argsort(rows, kind='stable')
+        arrays['indptr'] = np.concatenate(
+            [[0], np.cumsum(np.bincount(rows, minlength=len(node_ids)))])
+        arrays['indices'] = cols[order]
+        arrays['edge_index'] = eidx[order]
+
+        return cls(arrays)
+
+    def _layout(self):
+        # (name, offset, dtype, shape) of every array in one packed block
+        layout, offset = {}, 0
+        for name, arr in self.arrays.items():
+            arr = np.ascontiguousarray(arr)
+            layout[name] = (offset, arr.dtype.str, arr.shape)
+            offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+        return layout, max(offset, 1)
+
+    def to_shared_memory(self, name=None):
+        '''
+        Copy the arrays into one shared-memory block.
+
+        Returns
+        -------
+        (SharedMemory, manifest). The caller owns the block and must
+        close() and unlink() it when done. The manifest is a small dict
+        (picklable, JSON-serializable) to pass to CSRGraph.attach.
+
+        '''
+
+        layout, size = self._layout()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        for arr_name, (offset, dtype, shape) in layout.items():
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            view[...] = self.arrays[arr_name]
+        return shm, {'shm_name': shm.name, 'arrays': layout}
+
+    @classmethod
+    def attach(cls, manifest, pool_worker=True):
+        '''
+        Zero-copy read-only view of a graph placed in shared memory by
+        to_shared_memory.
+
+        Parameters
+        ----------
+        manifest : dict
+            Returned by to_shared_memory (possibly via JSON)
+        pool_worker : bool
+            True for processes started by the creating process
+            (multiprocessing / ProcessPoolExecutor workers), which share its
+            resource tracker. Set False when attaching from an unrelated
+            process (e.g. one that read the manifest from a file): its own
+            resource tracker would otherwise unlink the block when that
+            process exits.
+
+        '''
+
+        if pool_worker:
+            # Registering again with the shared tracker is a no-op, and
+            # unregistering here would remove the creator's registration
+            shm = shared_memory.SharedMemory(name=manifest['shm_name'])
+        elif sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=manifest['shm_name'], track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=manifest['shm_name'])
+            resource_tracker.unregister(shm._name, 'shared_memory')
+
+        arrays = {}
+        for name, (offset, dtype, shape) in manifest['arrays'].items():
+            arr = np.ndarray(tuple(shape), dtype=dtype, buffer=shm.buf, offset=offset)
+            arr.flags.writeable = False
+            arrays[name] = arr
+        return cls(arrays, shm=shm)
+
+    def detach(self):
+        '''Release an attached shared-memory block (does not unlink it)'''
+        if self._shm is not None:
+            self.arrays = {}
+            self._shm.close()
+            self._shm = None
+
+    def save(self, directory):
+        '''Write every array as .npy files in 'directory', for use with load()'''
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        names = {}
+        for i, (name, arr) in enumerate(self.arrays.items()):
+            fname = 'a{:02d}.npy'.format(i) # attribute names may contain ':'
+            np.save(directory / fname, np.ascontiguousarray(arr))
+            names[name] = fname
+        with open(directory / 'manifest.json', 'w') as f:
+            json.dump(names, f, indent=1)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        '''
+        Load arrays written by save(). With mmap=True the files are
+        memory-mapped read-only, so any number of processes share the
+        same pages through the OS cache.
+        '''
+
+        directory = Path(directory)
+        with open(directory / 'manifest.json') as f:
+            names = json.load(f)
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(directory / fname, mmap_mode=mode)
+                  for name, fname in names.items()}
+        return cls(arrays)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+geojson_stream.py
+
+Memory-bounded reader for large DRPEP GeoJSON exports.
+
+geopandas.read_file loads every feature, with all of its (mostly redundant)
+properties, before the pipeline keeps only a handful of columns. For
+territory-scale layers this is the peak memory of the whole pipeline.
+
+stream_geojson parses the "features" array one feature at a time, keeps only
+the requested properties, drops features from other circuits as it goes, and
+yields GeoDataFrames of at most 'chunksize' rows. Peak memory is one read
+block plus one chunk, regardless of file size.
+
+"""
+
+import json
+import re
+
+import numpy as np
+import pandas as pd
+import geopandas
+import shapely
+from shapely.geometry import shape
+
+
+# Columns kept by reproject_and_format.py
+DRPEP_COLUMNS = ['section_id', 'SHAPE__Length', 'objectid', 'node_id']
+
+_crs_pattern = re.compile(r'"crs"\s*:.*?"name"\s*:\s*"([^"]+)"', re.S)
+
+
+def _lookup(props, keys, keymap):
+    '''
+    Values of 'keys' in a feature's properties, matched case-insensitively
+    (professor.geojson uses 'section_id', ICA_Layer.geojson 'SECTION_ID' and
+    'Shape__Length'). 'keymap' maps lower-case names to the file's spelling;
+    it is reused across features and rebuilt only when a feature's keys
+    differ from the previous one's.
+    '''
+
+    values = []
+    for key in keys:
+        actual = keymap.get(key.lower())
+        if actual not in props:
+            keymap.clear()
+            keymap.update({k.lower(): k for k in props})
+            actual = keymap.get(key.lower())
+        values.append(props.get(actual))
+    return values
+
+
+def _crs_from_header(header):
+    match = _crs_pattern.search(header)
+    if match is None:
+        return "EPSG:4326" # GeoJSON default (RFC 7946)
+    name = match.group(1)
+    if name.endswith('CRS84'):
+        return "EPSG:4326"
+    return name
+
+
+def _iter_features(f, blocksize):
+    '''
+    Yield (crs, feature dict) for each feature in an open GeoJSON text file,
+    holding at most one feature plus one read block in memory.
+    '''
+
+    decoder = json.JSONDecoder()
+
+    # Read until the start of the "features" array
+    buf = ''
+    while True:
+        block = f.read(blocksize)
+        buf += block
+        match = re.search(r'"features"\s*:\s*\[', buf)
+        if match is not None:
+            break
+        if not block:
+            raise ValueError('No "features" array found')
+    crs = _crs_from_header(buf[:match.start()])
+    buf = buf[match.end():]
+    pos = 0
+    eof = False
+
+    while True:
+        # skip separators between features
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            block = f.read(blocksize)
+            eof = not block
+            buf, pos = block, 0
+
+        if pos >= len(buf) or buf[pos] == ']':
+            return
+
+        try:
+            feature, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            block = f.read(blocksize)
+            eof = not block
+            buf, pos = buf[pos:] + block, 0
+            continue
+
+        yield crs, feature
+        pos = end
+
+
+def _make_chunk(rows, geoms, columns, crs):
+    '''Build one GeoDataFrame from buffered properties and geometries'''
+
+    # LineStrings (all DRPEP line layers) are built in one vectorized call.
+    # Features with "geometry": null (allowed by GeoJSON) stay None.
+    is_line = np.array([g is not None and g['type'] == 'LineString' for g in geoms],
+                       dtype=bool)
+    geometry = np.empty(len(geoms), dtype=object)
+    if is_line.any():
+        coords = [g['coordinates'] for g, l in zip(geoms, is_line) if l]
+        counts = [len(c) for c in coords]
+        flat = np.array([xy[:2] for c in coords for xy in c], dtype=float)
+        indices = np.repeat(np.arange(len(coords)), counts)
+        geometry[is_line] = shapely.linestrings(flat, indices=indices)
+    for i in np.flatnonzero(~is_line):
+        if geoms[i] is not None:
+            geometry[i] = shape(geoms[i])
+
+    df = pd.DataFrame(rows, columns=columns)
+    return geopandas.GeoDataFrame(df, geometry=geometry, crs=crs)
+
+
+def stream_geojson(path, columns=DRPEP_COLUMNS, circuit=None, chunksize=10000,
+                   blocksize=1 << 20):
+    '''
+    Incrementally parse a GeoJSON FeatureCollection.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        GeoJSON file
+    columns : list of str
+        Feature properties to keep (matched case-insensitively)
+    circuit : str, optional
+        Keep only features whose 'circuit_name' matches (case-insensitive)
+    chunksize : int
+        Maximum number of features per yielded GeoDataFrame
+    blocksize : int
+        Number of characters read from the file at a time
+
+    Yields
+    ------
+    GeoDataFrame with 'columns' plus 'geometry', in the file's CRS
+
+    '''
+
+    if circuit is not None:
+        circuit = circuit.lower()
+
+    rows, geoms = [], []
+    keymap = {}
+    crs = "EPSG:4326"
+    emitted = False
+    with open(path, 'r', encoding='utf-8') as f:
+        for crs, feature in _iter_features(f, blocksize):
+            props = feature.get('properties') or {}
+            if circuit is not None:
+                name, = _lookup(props, ['circuit_name'], keymap)
+                if name is None or name.lower() != circuit:
+                    continue
+
+            rows.append(_lookup(props, columns, keymap))
+            geoms.append(feature.get('geometry'))
+            if len(rows) >= chunksize:
+                yield _make_chunk(rows, geoms, columns, crs)
+                rows, geoms = [], []
+                emitted = True
+
+    if rows or not emitted:
+        yield _make_chunk(rows, geoms, columns, crs)
+
+
+def read_geojson(path, columns=DRPEP_COLUMNS, circuit=None, chunksize=10000,
+                 blocksize=1 << 20):
+    '''
+    Streaming replacement for geopandas.read_file on DRPEP layers.
+    Only the requested columns are ever accumulated (see stream_geojson).
+
+    Returns
+    -------
+    GeoDataFrame with 'columns' plus 'geometry'
+
+    '''
+
+    chunks = stream_geojson(path, columns=columns, circuit=circuit,
+                            chunksize=chunksize, blocksize=blocksize)
+    gdf = pd.concat(list(chunks), ignore_index=True)
+    return geopandas.GeoDataFrame(gdf, geometry='geometry', crs=gdf.crs)
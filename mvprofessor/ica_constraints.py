@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+ica_constraints.py
+
+Binding-constraint classification of the hourly ICA data.
+
+Every row of the ICA table (node x month x hour x load profile) reports
+the hosting capacity allowed by each individual constraint. The overall
+hosting capacity is the smallest of them, so the "binding" constraint is the
+column holding the minimum, and the margin is how far the runner-up is
+above it. classify_binding computes this for all rows (all nodes, circuits,
+months, hours and profiles at once) with a single numpy pass, and the
+summary functions turn the result into per-node tables.
+
+Column names follow ingest_ICA_data.py (spaces replaced by underscores).
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Individual generation constraints (see ingest_ICA_data.py, fields 7-11)
+GEN_METRICS = ['Thermal_(kW)',
+               'SSV_(kW)',
+               'Voltage_Fluctuation_(kW)',
+               'Protection_(kW)',
+               'ICA_Operational_Flexibility_(kW)']
+
+# Individual load constraints (fields 13-15)
+LOAD_METRICS = ['Thermal_Load_(kW)',
+                'Volt_Variation_Load_(kW)',
+                'SSV_Load_(kW)']
+
+INDEX_COLS = ['Node_ID', 'Month', 'Hour', 'Load_Profile_Type']
+
+# 'binding' label of rows where several constraints share the minimum
+TIE = 'Tie'
+
+
+def classify_binding(phrs, metrics=GEN_METRICS, index_cols=INDEX_COLS):
+    '''
+    Find the binding constraint of every row.
+
+    Parameters
+    ----------
+    phrs : DataFrame
+        Hourly ICA data (Prof_ICA_data.pkl, or several circuits concatenated)
+    metrics : list of str
+        Constraint columns to compare, e.g. GEN_METRICS or LOAD_METRICS
+    index_cols : list of str
+        Columns identifying each row; any that are missing are skipped, and
+        a 'Circuit' column is carried along if present
+
+    Returns
+    -------
+    DataFrame with index_cols plus
+        'binding'  : name of the smallest constraint (NaN if all are
+                     missing), or TIE if several constraints share it
+        'tied'     : True where several constraints share the minimum
+        'tied_metrics': the tied constraints joined by '+' (NaN if no tie)
+        'capacity' : value of the binding constraint (kW)
+        'runner_up': name of the second smallest constraint
+        'margin'   : runner-up value minus binding value (kW, 0 for ties,
+                     inf if only one constraint is reported)
+
+    '''
+
+    keep = [c for c in ['Circuit'] + list(index_cols) if c in phrs.columns]
+    vals = phrs[metrics].to_numpy(dtype=float)
+    vals = np.where(np.isnan(vals), np.inf, vals)
+
+    # Two smallest values per row
+    vals = np.column_stack([vals, np.full(len(vals), np.inf)]) # pad for 1 metric
+    order = np.argsort(vals, axis=1)[:, :2]
+    first = np.take_along_axis(vals, order, axis=1)
+    names = np.asarray(list(metrics) + [np.nan], dtype=object)
+
+    has_first = np.isfinite(first[:, 0])
+    has_second = np.isfinite(first[:, 1])
+    margin = np.full(len(vals), np.nan)
+    margin[has_first] = first[has_first, 1] - first[has_first, 0]
+
+    # Ties (often several constraints at 0 kW) are not credited to
+    # whichever column happens to be listed first
+    tied = has_second & (first[:, 0] == first[:, 1])
+    tied_metrics = np.full(len(vals), np.nan, dtype=object)
+    if tied.any():
+        at_min = vals[tied, :-1] == first[tied, :1]
+        patterns, inverse = np.unique(at_min, axis=0, return_inverse=True)
+        labels = np.array(['+'.join(np.asarray(metrics)[p]) for p in patterns],
+                          dtype=object)
+        tied_metrics[tied] = labels[inverse.ravel()]
+
+    out = phrs[keep].copy()
+    out['binding'] = np.where(tied, TIE,
+                              np.where(has_first, names[order[:, 0]], np.nan))
+    out['tied'] = tied
+    out['tied_metrics'] = tied_metrics
+    out['capacity'] = np.where(has_first, first[:, 0], np.nan)
+    out['runner_up'] = np.where(has_second, names[order[:, 1]], np.nan)
+    out['margin'] = margin
+
+    return out
+
+
+def binding_share(binding, by=['Node_ID']):
+    '''
+    Share of rows (hours) in which each constraint binds; ties count under
+    the TIE column rather than under any one constraint.
+
+    Parameters
+    ----------
+    binding : DataFrame
+        Output of classify_binding
+    by : list of str
+        Grouping columns, e.g. ['Node_ID'] or ['Node_ID','Load_Profile_Type']
+
+    Returns
+    -------
+    DataFrame indexed by 'by', one column per constraint, rows sum to 1
+
+    '''
+
+    keys = [binding[c] for c in by]
+    return pd.crosstab(keys, binding['binding'], normalize='index')
+
+
+def binding_summary(binding, by=['Node_ID']):
+    '''
+    Margin statistics of each binding constraint.
+
+    Returns
+    -------
+    DataFrame indexed by 'by' + ['binding'] with the number of hours the
+    constraint binds, and the min/median margin and min capacity over those
+    hours
+
+    '''
+
+    grouped = binding.dropna(subset=['binding']).groupby(list(by) + ['binding'])
+    return grouped.agg(hours=('capacity', 'size'),
+                       min_capacity=('capacity', 'min'),
+                       min_margin=('margin', 'min'),
+                       median_margin=('margin', 'median'))
+
+
+def dominant_constraint(binding, by=['Node_ID']):
+    '''
+    Constraint that binds most often for each group, and its share of hours.
+    '''
+
+    share = binding_share(binding, by=by)
+    return pd.DataFrame({'dominant': share.idxmax(axis=1),
+                         'share': share.max(axis=1)})
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+ica_join.py
+
+Bulk spatial join of DRPEP ICA_Layer attributes (phase, circuit voltage,
+hosting capacity) onto the line sections and the derived graph.
+
+tree_builder stamps kv=16, phases=3 on every node. This stage replaces those
+placeholders with the ICA_Layer values in one pass:
+    1. candidate (section, ICA segment) pairs from a bulk spatial-index query
+    2. overlap length of every pair computed with vectorized shapely predicates
+    3. best-overlapping ICA segment per section
+    4. attributes written to every graph edge (by section_id) and node
+
+Edges and nodes without a match keep the tree_builder placeholders (kv=16,
+phases=3); the 'ica_matched' attribute tells them apart from measured values.
+
+"""
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+import shapely
+
+from mvprofessor.geojson_stream import read_geojson
+
+
+# ICA_Layer property -> attribute name on the sections/graph
+ICA_ATTRIBUTES = {'phase': 'phases',
+                  'circuit_voltage': 'kv',
+                  'ica_overall_pv': 'ica_pv',
+                  'ica_overall_load': 'ica_load',
+                  'uniform_generation': 'ica_uniform_gen'}
+
+# tree_builder placeholders, kept where the ICA_Layer has no value
+PLACEHOLDERS = {'kv': 16, 'phases': 3}
+
+
+def load_ica_layer(path, circuit=None, crs="EPSG:2955"):
+    '''
+    Read the ICA_Layer and re-project it to match the line sections.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        ICA_Layer.geojson
+    circuit : str, optional
+        Circuit name to keep (e.g. 'Professor')
+    crs : str
+        Target CRS, EPSG2955 (UTM11) like professor.pkl
+
+    Returns
+    -------
+    GeoDataFrame with 'ica_section_id' and the ICA_ATTRIBUTES columns
+    renamed to their graph names. Non-numeric values such as 'Redacted'
+    become NaN.
+
+    '''
+
+    cols = ['section_id'] + list(ICA_ATTRIBUTES)
+    ica = read_geojson(path, columns=cols, circuit=circuit)
+    ica = ica.rename(columns={'section_id': 'ica_section_id'})
+
+    for col, name in ICA_ATTRIBUTES.items():
+        ica[name] = pd.to_numeric(ica.pop(col), errors='coerce').astype(float)
+
+    return ica.to_crs(crs)
+
+
+def match_sections(lines, ica, tolerance=1.0, min_overlap=0.5):
+    '''
+    Match each line section to the ICA segment it overlaps the most.
+
+    Parameters
+    ----------
+    lines : GeoDataFrame
+        Line sections (professor.pkl), indexed by section_id
+    ica : GeoDataFrame
+        Output of load_ica_layer, in the same CRS as 'lines'
+    tolerance : float
+        Distance (in meters) within which the two layers count as overlapping.
+        Re-projection and digitizing differences are well under 1m.
+    min_overlap : float
+        Minimum fraction of a section's length that must overlap its match
+
+    Returns
+    -------
+    DataFrame indexed like 'lines' with 'ica_section_id', 'overlap' (the
+    fraction of the section covered) and the ICA attributes. Sections without
+    a match have NaN attributes.
+
+    '''
+
+    attrs = list(ICA_ATTRIBUTES.values())
+    sec_geom = lines.geometry.values
+    ica_buf = shapely.buffer(ica.geometry.values, tolerance, cap_style='flat')
+
+    # All candidate pairs in one bulk query (STRtree)
+    i_ica, i_sec = lines.sindex.query(ica_buf, predicate='intersects')
+
+    # Overlap length of each candidate pair, vectorized
+    overlap = shapely.length(shapely.intersection(sec_geom[i_sec], ica_buf[i_ica]))
+    overlap = overlap/np.maximum(shapely.length(sec_geom[i_sec]), 1e-9)
+
+    pairs = pd.DataFrame({'sec': i_sec, 'ica': i_ica, 'overlap': overlap})
+    pairs = pairs[pairs['overlap'] >= min_overlap]
+    best = pairs.sort_values('overlap').drop_duplicates('sec', keep='last')
+
+    matched = pd.DataFrame(index=lines.index,
+                           columns=['ica_section_id', 'overlap'] + attrs,
+                           dtype=float)
+    rows = ica.iloc[best['ica'].to_numpy()]
+    matched.iloc[best['sec'].to_numpy()] = np.column_stack(
+        [rows['ica_section_id'], best['overlap']] + [rows[a] for a in attrs])
+
+    return matched
+
+
+def apply_ica_attributes(G, matched, node_agg=None):
+    '''
+    Write matched ICA attributes to the edges and nodes of G, in place.
+
+    Edges take the attributes of their section (via the 'section_id' edge
+    attribute). Nodes aggregate the attributes of their incident edges:
+    by default the largest phase count and voltage, and the most
+    constraining (smallest) hosting capacity. Missing kv/phases fall back to
+    PLACEHOLDERS on both edges and nodes, phases is stored as int, and
+    'ica_matched' is True on edges whose section was matched and on nodes
+    with at least one matched incident edge.
+
+    Parameters
+    ----------
+    G : networkx.Graph
+        Output of tree_builder (possibly with contracted nodes)
+    matched : DataFrame
+        Output of match_sections
+    node_agg : dict, optional
+        Attribute -> aggregation function name, overriding the defaults
+
+    Returns
+    -------
+    G
+
+    '''
+
+    attrs = list(ICA_ATTRIBUTES.values())
+    agg = {'phases': 'max', 'kv': 'max', 'ica_pv': 'min',
+           'ica_load': 'min', 'ica_uniform_gen': 'min'}
+    if node_agg is not None:
+        agg.update(node_agg)
+
+    edges = nx.to_pandas_edgelist(G)[['source', 'target', 'section_id']]
+    edges = edges.join(matched[attrs], on='section_id')
+    edges['ica_matched'] = edges['section_id'].map(
+        matched['ica_section_id'].notna()).fillna(False).astype(bool)
+
+    # Edge attributes, with the placeholders where nothing was matched
+    edge_attrs = edges.set_index(['source', 'target'])[attrs + ['ica_matched']]
+    edge_attrs = edge_attrs.fillna(PLACEHOLDERS).astype({'phases': int})
+    nx.set_edge_attributes(G, edge_attrs.to_dict('index'))
+
+    # Node attributes, aggregated over incident edges
+    ends = pd.concat([edges.rename(columns={'source': 'node'}),
+                      edges.rename(columns={'target': 'node'})])
+    node_attrs = ends.groupby('node')[attrs].agg(agg)
+    node_attrs = node_attrs.dropna(how='all')
+    node_matched = ends.groupby('node')['ica_matched'].any()
+    nx.set_node_attributes(G, False, name='ica_matched')
+    nx.set_node_attributes(G, node_matched.to_dict(), name='ica_matched')
+
+    # Keep the placeholders where nothing was matched
+    for name, col in node_attrs.items():
+        col = col.dropna()
+        if name == 'phases':
+            col = col.astype(int)
+        nx.set_node_attributes(G, col.to_dict(), name=name)
+
+    return G
+
+
+def node_attribute_table(G, attrs=None):
+    '''
+    Node attributes of G as a DataFrame indexed by enode_id, e.g. to join
+    onto the output of make_enodes.
+    '''
+
+    if attrs is None:
+        attrs = list(ICA_ATTRIBUTES.values()) + ['ica_matched']
+    table = pd.DataFrame.from_dict(dict(G.nodes(data=True)), orient='index')
+    table = table.reindex(columns=attrs)
+    table.index.name = 'enode_id'
+    return table
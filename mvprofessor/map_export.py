@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+map_export.py
+
+Time-series map overlays with a compact binary payload.
+
+Making a folium map per hour repeats every geometry in every file. Here the
+geometry is written once (GeoJSON), the values of every feature at every
+time slice go into one typed binary array (time slices x features), and a
+small Leaflet page switches between slices client-side. A full year of
+12 months x 24 hours x 2 profiles for a few hundred features is ~0.3 MB.
+
+Output directory:
+    geometry.geojson   features, in EPSG:4326, with a '_i' column (row in values)
+    values.bin         little-endian uint16 (quantized) or float32 array
+    meta.json          shape, dtype, scale/offset, slice labels, color range
+    index.html         viewer
+
+Browsers do not fetch local files from file:// pages, so either serve the
+directory (python -m http.server) or use embed=True, which inlines the
+payload into index.html as base64.
+
+"""
+
+import base64
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+_NODATA = 65535 # uint16 marker for NaN
+
+
+def ica_timeseries(phrs, field, profile='MIN'):
+    '''
+    Reshape the hourly ICA data into one row per node and one column per
+    (Month, Hour) slice.
+
+    Parameters
+    ----------
+    phrs : DataFrame
+        Hourly ICA data (Prof_ICA_data.pkl)
+    field : str
+        Column to map, e.g. 'Voltage_Fluctuation_(kW)'
+    profile : str or None
+        Load_Profile_Type to keep ('MIN' or 'MAX'); None keeps both, adding
+        the profile as the first column level
+
+    Returns
+    -------
+    DataFrame indexed by Node_ID with (Month, Hour) columns
+
+    '''
+
+    cols = ['Month', 'Hour']
+    if profile is None:
+        cols = ['Load_Profile_Type'] + cols
+    else:
+        phrs = phrs[phrs['Load_Profile_Type'] == profile]
+    table = phrs.pivot_table(index='Node_ID', columns=cols, values=field,
+                             aggfunc='mean')
+    return table.sort_index(axis=1)
+
+
+def _slice_labels(columns):
+    labels = []
+    for col in columns:
+        col = col if isinstance(col, tuple) else (col,)
+        labels.append(' '.join(str(c) for c in col))
+    return labels
+
+
+def _quantize(values, vmin, vmax):
+    scale = (vmax - vmin)/(_NODATA - 1) if vmax > vmin else 1.0
+    q = np.round((values - vmin)/scale)
+    q = np.where(np.isnan(values), _NODATA, np.clip(q, 0, _NODATA - 1))
+    return q.astype('<u2'), scale
+
+
+def export_timeseries_map(out_dir, features, values, labels=None,
+                          value_name='value', dtype='uint16', embed=False,
+                          precision=6):
+    '''
+    Write geometry, a binary value array and a viewer page.
+
+    Parameters
+    ----------
+    out_dir : str or pathlib.Path
+        Output directory (created if needed)
+    features : GeoDataFrame
+        Features to draw (line sections, enodes, ...); any CRS
+    values : array-like or DataFrame, shape (len(features), n_slices)
+        Value of each feature at each time slice. NaN is drawn grey.
+        If a DataFrame, its columns provide the default labels.
+    labels : list of str, optional
+        Label of each time slice
+    value_name : str
+        Name shown in the viewer
+    dtype : 'uint16' or 'float32'
+        uint16 quantizes the values linearly between their min and max
+        (resolution (max-min)/65534), halving the payload
+    embed : bool
+        Inline geometry and values into index.html (opens from file://)
+    precision : int
+        Decimal places kept in the coordinates (6 ~ 0.1m)
+
+    Returns
+    -------
+    pathlib.Path of index.html
+
+    '''
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if labels is None and isinstance(values, pd.DataFrame):
+        labels = _slice_labels(values.columns)
+    values = np.asarray(values, dtype=float)
+    if values.ndim != 2 or values.shape[0] != len(features):
+        raise ValueError('values must have shape (len(features), n_slices)')
+    n_feat, n_slices = values.shape
+    if labels is None:
+        labels = [str(t) for t in range(n_slices)]
+
+    # Geometry once, without any per-slice properties
+    geo = features.geometry.to_crs("EPSG:4326").reset_index(drop=True)
+    geo = geo.rename('geometry').to_frame().set_geometry('geometry')
+    geo['_i'] = np.arange(n_feat)
+    geojson = geo.to_json(drop_id=True, to_wgs84=False)
+    geojson = json.dumps(json.loads(geojson, parse_float=lambda x: round(float(x), precision)),
+                         separators=(',', ':'))
+
+    # Values, time-major so each slice is one contiguous block
+    finite = values[np.isfinite(values)]
+    vmin = float(finite.min()) if len(finite) else 0.0
+    vmax = float(finite.max()) if len(finite) else 1.0
+    if dtype == 'uint16':
+        payload, scale = _quantize(values.T, vmin, vmax)
+    elif dtype == 'float32':
+        payload, scale = values.T.astype('<f4'), 1.0
+    else:
+        raise ValueError("dtype must be 'uint16' or 'float32'")
+    payload = np.ascontiguousarray(payload).tobytes()
+
+    meta = {'n_features': n_feat, 'n_slices': n_slices, 'dtype': dtype,
+            'scale': scale, 'offset': vmin, 'nodata': _NODATA,
+            'vmin': vmin, 'vmax': vmax, 'labels': list(labels),
+            'value_name': value_name}
+
+    if embed:
+        data = ('const EMBED = {geometry: ' + geojson
+                + ', values: "' + base64.b64encode(payload).decode('ascii') + '"};')
+    else:
+        (out_dir / 'geometry.geojson').write_text(geojson)
+        (out_dir / 'values.bin').write_bytes(payload)
+        data = 'const EMBED = null;'
+
+    html = _VIEWER.replace('/*META*/', 'const META = ' + json.dumps(meta) + ';')
+    html = html.replace('/*DATA*/', data)
+    (out_dir / 'meta.json').write_text(json.dumps(meta, indent=1))
+    (out_dir / 'index.html').write_text(html)
+
+    return out_dir / 'index.html'
+
+
+_VIEWER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>mvprofessor time-series map</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+  html, body, #map {height: 100%; margin: 0;}
+  #panel {position: absolute; top: 10px; right: 10px; z-index: 1000;
+          background: white; padding: 8px; font: 13px sans-serif;
+          border-radius: 4px; box-shadow: 0 1px 4px rgba(0,0,0,0.4);}
+  #slider {width: 300px;}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="panel">
+  <b id="name"></b>: <span id="label"></span><br>
+  <input id="slider" type="range" min="0" value="0" step="1"><br>
+  <span id="range"></span>
+</div>
+<script>
+/*META*/
+/*DATA*/
+
+// viridis, sampled at 5 points
+const STOPS = [[68,1,84],[59,82,139],[33,145,140],[94,201,98],[253,231,37]];
+function color(v) {
+  if (v === null) return '#999999';
+  let t = META.vmax > META.vmin ? (v - META.vmin)/(META.vmax - META.vmin) : 0;
+  t = Math.min(Math.max(t, 0), 1)*(STOPS.length - 1);
+  const i = Math.min(Math.floor(t), STOPS.length - 2), f = t - i;
+  const c = STOPS[i].map((a, k) => Math.round(a + f*(STOPS[i+1][k] - a)));
+  return 'rgb(' + c.join(',') + ')';
+}
+
+function decode(buffer) {
+  const raw = META.dtype === 'uint16' ? new Uint16Array(buffer) : new Float32Array(buffer);
+  return function(t, i) {
+    const q = raw[t*META.n_features + i];
+    if (META.dtype === 'uint16') return q === META.nodata ? null : META.offset + q*META.scale;
+    return isNaN(q) ? null : q;
+  };
+}
+
+function show(geometry, value) {
+  const map = L.map('map');
+  L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png',
+              {attribution: '&copy; OpenStreetMap contributors'}).addTo(map);
+  const layer = L.geoJSON(geometry, {
+    pointToLayer: (f, ll) => L.circleMarker(ll, {radius: 5, fillOpacity: 1}),
+    style: {weight: 4}
+  }).addTo(map);
+  map.fitBounds(layer.getBounds());
+
+  const slider = document.getElementById('slider');
+  slider.max = META.n_slices - 1;
+  document.getElementById('name').textContent = META.value_name;
+  document.getElementById('range').textContent =
+      META.vmin.toPrecision(4) + ' to ' + META.vmax.toPrecision(4);
+
+  function update() {
+    const t = +slider.value;
+    document.getElementById('label').textContent = META.labels[t];
+    layer.eachLayer(l => {
+      const v = value(t, l.feature.properties._i);
+      l.setStyle({color: color(v), fillColor: color(v)});
+      l.bindTooltip(META.value_name + ': ' + (v === null ? 'n/a' : v.toPrecision(4)));
+    });
+  }
+  slider.addEventListener('input', update);
+  update();
+}
+
+if (EMBED) {
+  const bin = atob(EMBED.values), bytes = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+  show(EMBED.geometry, decode(bytes.buffer));
+} else {
+  Promise.all([fetch('geometry.geojson').then(r => r.json()),
+               fetch('values.bin').then(r => r.arrayBuffer())])
+    .then(([g, b]) => show(g, decode(b)));
+}
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+qsts.py
+
+Quasi-static time-series (QSTS) driver for full-year studies on the
+derived radial topology.
+
+The ICA data only covers 12 representative months x 24 hours. run_qsts
+steps a radial power flow through any number of time steps (8760 hourly,
+or finer), a chunk of time steps at a time:
+
+    - the solver is a backward/forward sweep on the substation-rooted tree
+      (topology_index.py), vectorized over nodes AND over the time steps of
+      the chunk. Branch currents are subtree sums and voltage drops are
+      path-to-root sums, both read off prefix sums over the DFS preorder.
+    - node voltages and branch flows are written to memory-mapped .npy files
+      (time x node) chunk by chunk, so RAM holds one chunk at most
+    - per-node violation counts are accumulated as the chunks finish
+
+Only the component containing the substation is solved; nodes in other
+components are reported as NaN. Time steps where the sweep does not converge
+(e.g. a load beyond the feeder's transfer limit) are also written as NaN,
+left out of the violation counts, and listed in meta.json. Edges outside the
+BFS spanning tree (loops left by manual contractions) are ignored by the
+radial solver.
+
+"""
+
+import json
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from mvprofessor.topology_index import TopologyIndex
+from mvprofessor.sparse_matrices import Z_PER_KM
+
+
+def hour_of_year(year=2023, freq='h'):
+    '''
+    Month (1-12) and hour (0-23) of every time step in 'year', e.g. to
+    expand the 12x24 ICA tables to 8760 hours.
+
+    Returns
+    -------
+    DataFrame indexed by timestamp with 'Month' and 'Hour' columns
+
+    '''
+
+    t = pd.date_range(str(year), str(year + 1), freq=freq, inclusive='left')
+    return pd.DataFrame({'Month': t.month, 'Hour': t.hour}, index=t)
+
+
+def expand_month_hour(table, year=2023, freq='h'):
+    '''
+    Expand a (Month, Hour) table to every time step of a year.
+
+    Parameters
+    ----------
+    table : DataFrame
+        Rows indexed by anything (e.g. Node_ID), columns a (Month, Hour)
+        MultiIndex (as returned by map_export.ica_timeseries)
+
+    Returns
+    -------
+    numpy.ndarray, shape (len(table), n_steps)
+
+    '''
+
+    steps = hour_of_year(year, freq)
+    cols = pd.MultiIndex.from_arrays([steps['Month'], steps['Hour']])
+    return table.reindex(columns=cols).to_numpy(dtype=float)
+
+
+def _per_node(values, index):
+    # dict/Series keyed by node id -> array in index order
+    if isinstance(values, (dict, pd.Series)):
+        return pd.Series(values, dtype=float).reindex(index.nodes).fillna(0).to_numpy()
+    return np.asarray(values, dtype=float)
+
+
+def _profile(base, shape, t0, t1):
+    # kW at every node for time steps t0:t1, shape (n, t1 - t0)
+    if shape is None:
+        return np.zeros((len(base), t1 - t0))
+    shape = np.asarray(shape[..., t0:t1], dtype=float)
+    if shape.ndim == 1:
+        return base[:, None]*shape[None, :]
+    return base[:, None]*shape
+
+
+def _sweep(index, z, s_pu, v0, tol, max_iter):
+    '''
+    Backward/forward sweep for constant-power loads.
+
+    Parameters
+    ----------
+    index : TopologyIndex
+    z : numpy.ndarray, shape (n,)
+        Per-unit impedance of the branch above each node (0 at roots)
+    s_pu : numpy.ndarray, shape (n, k)
+        Per-unit complex load at each node (generation negative)
+    v0 : complex
+        Substation voltage (per unit)
+
+    Returns
+    -------
+    (V, I, iterations, converged): node voltages and branch currents
+    (branch above each node), both shape (n, k), the number of iterations,
+    and a boolean array (k,) flagging the time steps that converged. V and I
+    of the other time steps are the last iterate and are not a solution.
+
+    '''
+
+    n, k = s_pu.shape
+    order, tin, tout = index.order, index.tin, index.tout
+    V = np.full((n, k), v0, dtype=complex)
+    for it in range(1, max_iter + 1):
+        # backward: branch current = sum of load currents in the subtree
+        inj = np.conj(s_pu/V)
+        cs = np.vstack([np.zeros((1, k)), np.cumsum(inj[order], axis=0)])
+        I = cs[tout] - cs[tin]
+
+        # forward: voltage drop = sum of z*I on the path to the root
+        drop = np.zeros((n + 1, k), dtype=complex)
+        np.add.at(drop, tin, z[:, None]*I)
+        np.add.at(drop, tout, -z[:, None]*I)
+        drop = np.cumsum(drop, axis=0)[:-1]
+        V_new = v0 - drop[tin]
+
+        with np.errstate(invalid='ignore', over='ignore'):
+            converged = np.max(np.abs(V_new - V), axis=0) < tol
+        V = V_new
+        if converged.all():
+            break
+    return V, I, it, converged
+
+
+def run_qsts(G, root, out_dir, load_kw, load_shape, pv_kw=None, pv_shape=None,
+             pf=0.95, chunk=168, z_per_km=Z_PER_KM, base_kv=16.0, base_mva=10.0,
+             v0=1.0, v_limits=(0.95, 1.05), ampacity=None, tol=1e-6,
+             max_iter=30, index=None, verbose=False):
+    '''
+    Run a radial QSTS study and stream the results to disk.
+
+    Parameters
+    ----------
+    G : networkx.Graph
+        Electrical graph (tree_builder output)
+    root : node id or shapely.Point
+        Substation; not needed if 'index' is given
+    out_dir : str or pathlib.Path
+        Results directory (see open_results)
+    load_kw : array-like (n,) or dict/Series keyed by node id
+        Peak load at each node (kW)
+    load_shape : array-like, (T,) or (n, T)
+        Per-unit load profile, common to all nodes or one row per node.
+        May be a memory-mapped array; only one chunk of it is read at a time.
+    pv_kw, pv_shape : optional
+        Installed PV (kW) and per-unit PV profile, same layout as the load.
+        Both or neither must be given.
+    pf : float
+        Load power factor (lagging); PV runs at unity power factor
+    chunk : int
+        Time steps solved together
+    z_per_km : complex
+        Line impedance (ohm/km), as in SparseNetwork.ybus
+    base_kv, base_mva : float
+        Per-unit bases
+    v0 : float
+        Substation voltage (per unit)
+    v_limits : (float, float)
+        Voltage band for violation counts (Rule 2: +/-5%)
+    ampacity : array-like (n,) or dict/Series, optional
+        Ampacity (A) of the branch above each node, for overload counts
+    tol, max_iter : sweep convergence settings
+
+    Returns
+    -------
+    DataFrame indexed by node id: hours below/above the voltage band,
+    min/max voltage, and (if ampacity is given) overloaded hours of the
+    branch above the node. Non-converged time steps are not counted; they
+    are listed under 'non_converged' in meta.json and trigger a warning.
+
+    '''
+
+    if (pv_kw is None) != (pv_shape is None):
+        raise ValueError('pv_kw and pv_shape must be given together')
+    if index is None:
+        index = TopologyIndex(G, root)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    n = len(index.nodes)
+    load_kw = _per_node(load_kw, index)
+    pv_kw = _per_node(pv_kw, index) if pv_kw is not None else np.zeros(n)
+    T = np.shape(load_shape)[-1]
+
+    # Only the substation's component is solved
+    live = index.component == 0
+    has_parent = index.parent >= 0
+    length = np.zeros(n)
+    length[has_parent] = index.dist[has_parent] - index.dist[index.parent[has_parent]]
+    z_base = base_kv**2/base_mva
+    z = z_per_km*length/1000/z_base
+    i_base = base_mva*1e3/(np.sqrt(3)*base_kv) # A
+    q_ratio = np.tan(np.arccos(pf))
+    if ampacity is not None:
+        ampacity = _per_node(ampacity, index)
+
+    # Memory-mapped results, time x node
+    mm = {}
+    for name in ['vm', 'va', 'p_flow', 'q_flow', 'i_flow']:
+        mm[name] = np.lib.format.open_memmap(out_dir / (name + '.npy'), mode='w+',
+                                             dtype=np.float32, shape=(T, n))
+
+    under = np.zeros(n, dtype=np.int64)
+    over = np.zeros(n, dtype=np.int64)
+    overload = np.zeros(n, dtype=np.int64)
+    vmin = np.full(n, np.inf)
+    vmax = np.full(n, -np.inf)
+    failed = []
+
+    for t0 in range(0, T, chunk):
+        t1 = min(t0 + chunk, T)
+        p = _profile(load_kw, load_shape, t0, t1)
+        g = _profile(pv_kw, pv_shape, t0, t1)
+        s_pu = ((p - g) + 1j*p*q_ratio)/(base_mva*1e3)
+        s_pu[~live] = 0
+
+        V, I, iters, converged = _sweep(index, z, s_pu, v0, tol, max_iter)
+        if verbose:
+            print('steps {}-{}: {} iterations, {} not converged'.format(
+                t0, t1, iters, (~converged).sum()))
+        V[:, ~converged] = np.nan
+        I[:, ~converged] = np.nan
+        failed.extend(int(t) for t in t0 + np.flatnonzero(~converged))
+
+        # branch flow at the sending (parent) end
+        vp = np.where(has_parent[:, None], V[np.maximum(index.parent, 0)], v0)
+        S = vp*np.conj(I)*base_mva*1e3 # kVA
+        vm = np.abs(V)
+        vm[~live] = np.nan
+        S[~live | ~has_parent] = np.nan
+        amps = np.abs(I)*i_base
+        amps[~live | ~has_parent] = np.nan
+
+        mm['vm'][t0:t1] = vm.T
+        mm['va'][t0:t1] = np.degrees(np.angle(V)).T
+        mm['p_flow'][t0:t1] = S.real.T
+        mm['q_flow'][t0:t1] = S.imag.T
+        mm['i_flow'][t0:t1] = amps.T
+
+        under += (vm < v_limits[0]).sum(axis=1)
+        over += (vm > v_limits[1]).sum(axis=1)
+        vmin = np.fmin(vmin, np.nanmin(vm, axis=1, initial=np.inf, where=live[:, None]))
+        vmax = np.fmax(vmax, np.nanmax(vm, axis=1, initial=-np.inf, where=live[:, None]))
+        if ampacity is not None:
+            overload += (amps > ampacity[:, None]).sum(axis=1)
+
+    for arr in mm.values():
+        arr.flush()
+    del mm
+
+    meta = {'nodes': index.nodes.tolist(),
+            'n_steps': T,
+            'chunk': chunk,
+            'base_kv': base_kv,
+            'base_mva': base_mva,
+            'v_limits': list(v_limits),
+            'non_converged': failed,
+            'arrays': {'vm': 'voltage magnitude (pu)',
+                       'va': 'voltage angle (deg)',
+                       'p_flow': 'active power into the branch above each node (kW)',
+                       'q_flow': 'reactive power into the branch above each node (kvar)',
+                       'i_flow': 'current in the branch above each node (A)'}}
+    with open(out_dir / 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=1)
+    if failed:
+        warnings.warn('power flow did not converge at {} of {} time steps '
+                      '(written as NaN, see meta.json)'.format(len(failed), T))
+
+    summary = pd.DataFrame({'hours_under': under,
+                            'hours_over': over,
+                            'v_min': np.where(live, vmin, np.nan),
+                            'v_max': np.where(live, vmax, np.nan)},
+                           index=pd.Index(index.nodes, name='node'))
+    if ampacity is not None:
+        summary['hours_overload'] = overload
+    summary.to_pickle(out_dir / 'violations.pkl')
+    return summary
+
+
+def open_results(out_dir):
+    '''
+    Memory-map the arrays written by run_qsts (read-only).
+
+    Returns
+    -------
+    (arrays, meta): dict of (time x node) numpy.memmap, and the metadata
+
+    '''
+
+    out_dir = Path(out_dir)
+    with open(out_dir / 'meta.json') as f:
+        meta = json.load(f)
+    arrays = {name: np.load(out_dir / (name + '.npy'), mmap_mode='r')
+              for name in meta['arrays']}
+    return arrays, meta
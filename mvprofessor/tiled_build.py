@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+tiled_build.py
+
+Spatially tiled topology build for layers too large to process in one piece.
+
+The single-pass pipeline (get_endpoints -> make_blobs -> tree_builder) buffers
+and unions every endpoint of the layer in one piece. Here the geometric work
+is done one tile at a time:
+
+    1. endpoints are extracted chunk by chunk (e.g. from stream_geojson)
+    2. endpoints are split into square tiles; each tile also receives the
+       points within an overlap margin of 2*buffer_radius around it, so every
+       pair of endpoints whose buffers touch is seen together in some tile
+    3. each tile clusters its points on a process pool (STRtree 'dwithin'
+       query + connected components)
+    4. clusters that straddle tile boundaries are merged by a union-find
+       pass (connected components) over the per-tile results
+    5. blob polygons are built per tile, and lines become edges between the
+       blobs containing their two endpoints
+
+Two endpoints share a blob exactly when they are chained by buffers that
+intersect (polygons with QUAD_SEGS segments per quarter circle, as in
+make_blobs), i.e. by hops of at most 2*buffer_radius. The blob polygons and
+the edges are the same as make_blobs/tree_builder, and do not depend on the
+tile size.
+
+Blob ids are not the same: make_blobs numbers blobs in the order GEOS
+returns the parts of one global union, which cannot be reproduced tile by
+tile. Here blobs are numbered by their lowest endpoint index, or after a
+reference blob layer (e.g. saved from a single-pass run) so that node ids
+picked on its maps stay valid.
+
+This is not an out-of-core build. The endpoints (4 floats per line), the
+edge attribute table, the tile membership of every endpoint, the blob
+polygons and the graph are held for the whole layer, i.e. memory still grows
+with the number of lines. What the tiles bound is the geometric working set:
+STRtrees, endpoint buffers and polygon unions, which dominate the
+single-pass build. Tiles are handed to the workers a few at a time rather
+than all at once. The LineStrings are only kept with keep_geometry=True.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+import geopandas
+import networkx as nx
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+EDGE_COLUMNS = ['SHAPE__Length', 'objectid', 'node_id']
+
+# Segments per quarter circle of the endpoint buffers; geopandas' default,
+# as used by make_blobs
+QUAD_SEGS = 16
+
+
+def _components(n, i, j):
+    # union-find over n items joined by pairs (i, j)
+    adj = coo_matrix((np.ones(len(i), dtype=bool), (i, j)), shape=(n, n))
+    return connected_components(adj, directed=False)[1]
+
+
+def _canonical(labels):
+    # renumber clusters by the lowest index among their members
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse]
+
+
+def _tile_clusters(task):
+    '''
+    Cluster the points of one tile (plus its margin).
+    Returns pairs (point, representative point), in global indices.
+    '''
+
+    gidx, xy, buffer_radius = task
+    # Intersecting buffer polygons, as in make_blobs (their centers are at
+    # most 2*buffer_radius apart)
+    halos = shapely.buffer(shapely.points(xy), buffer_radius, quad_segs=QUAD_SEGS)
+    i, j = shapely.STRtree(halos).query(halos, predicate='intersects')
+    labels = _components(len(halos), i, j)
+    _, first = np.unique(labels, return_index=True)
+    return gidx, gidx[first[labels]]
+
+
+def _tile_blobs(task):
+    '''Blob polygons (union of endpoint buffers) of the clusters in one tile'''
+
+    labels, xy, buffer_radius = task
+    order = np.argsort(labels, kind='stable')
+    labels, xy = labels[order], xy[order]
+    uniq, start = np.unique(labels, return_index=True)
+    halos = shapely.buffer(shapely.points(xy), buffer_radius, quad_segs=QUAD_SEGS)
+    blobs = [shapely.union_all(h) for h in np.split(halos, start[1:])]
+    return uniq, blobs
+
+
+def _run_tiles(func, tasks, n_workers):
+    # Map func over a lazy iterable of tile tasks, keeping at most a few
+    # tasks per worker in flight so their arrays are not all built up front
+    if n_workers <= 1:
+        return [func(t) for t in tasks]
+    results = []
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        while True:
+            batch = list(islice(tasks, 4*n_workers))
+            if not batch:
+                break
+            results.extend(ex.map(func, batch))
+    return results
+
+
+def read_endpoints(chunks, columns=EDGE_COLUMNS, keep_geometry=False):
+    '''
+    Extract line endpoints (and the attributes needed for edges) from a
+    GeoDataFrame or an iterable of GeoDataFrame chunks.
+
+    Parameters
+    ----------
+    chunks : GeoDataFrame or iterable of GeoDataFrame
+        Line sections in a projected CRS (meters), indexed by section_id
+        or with a 'section_id' column
+    columns : list of str
+        Attributes carried onto the graph edges
+    keep_geometry : bool
+        Also keep the LineStrings (for edge 'geometry'); memory then grows
+        with the layer again
+
+    Returns
+    -------
+    (xy, sections): xy is a (2L, 2) array with all start points followed by
+    all end points (same order as get_endpoints), sections a DataFrame of
+    the L lines
+
+    '''
+
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+
+    starts, ends, sections = [], [], []
+    for chunk in chunks:
+        if 'section_id' in chunk.columns:
+            chunk = chunk.set_index('section_id')
+        geoms = chunk.geometry.values
+        starts.append(shapely.get_coordinates(shapely.get_point(geoms, 0)))
+        ends.append(shapely.get_coordinates(shapely.get_point(geoms, -1)))
+        cols = [c for c in columns if c in chunk.columns]
+        if keep_geometry:
+            cols = cols + [chunk.geometry.name]
+        sections.append(pd.DataFrame(chunk[cols]))
+
+    xy = np.vstack(starts + ends) if starts else np.zeros((0, 2))
+    sections = pd.concat(sections) if sections else pd.DataFrame(columns=columns)
+    sections.index.name = 'section_id'
+    return xy, sections
+
+
+def cluster_endpoints(xy, buffer_radius, tile_size=None, n_workers=1):
+    '''
+    Label each endpoint with its blob.
+
+    Parameters
+    ----------
+    xy : numpy.ndarray, shape (N, 2)
+        Endpoint coordinates (meters)
+    buffer_radius : float
+        Same meaning as in make_blobs
+    tile_size : float, optional
+        Tile edge length (meters); None clusters everything in one pass.
+        Must exceed 2*buffer_radius.
+    n_workers : int
+        Number of worker processes for the tiles
+
+    Returns
+    -------
+    numpy.ndarray of blob labels 0..B-1, numbered by lowest endpoint index
+
+    '''
+
+    n = len(xy)
+    margin = 2*buffer_radius
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if tile_size is None:
+        _, rep = _tile_clusters((np.arange(n), xy, buffer_radius))
+        return _canonical(rep)
+
+    if tile_size <= margin:
+        raise ValueError('tile_size must exceed 2*buffer_radius')
+
+    # Every tile a point falls in, including the overlap margins. With
+    # tile_size < 4*buffer_radius the margin box can span three tiles or
+    # more per axis, so walk every offset from lo to hi.
+    lo = np.floor((xy - margin)/tile_size).astype(np.int64)
+    hi = np.floor((xy + margin)/tile_size).astype(np.int64)
+    span = hi - lo
+    memb = []
+    for ox in range(span[:, 0].max() + 1):
+        for oy in range(span[:, 1].max() + 1):
+            keep = (span[:, 0] >= ox) & (span[:, 1] >= oy)
+            memb.append(np.column_stack([lo[keep, 0] + ox, lo[keep, 1] + oy,
+                                         np.flatnonzero(keep)]))
+    memb = np.unique(np.vstack(memb), axis=0) # sorted by tile, then point
+
+    tiles, start = np.unique(memb[:, :2], axis=0, return_index=True)
+    groups = np.split(memb[:, 2], start[1:])
+    tasks = ((g, xy[g], buffer_radius) for g in groups)
+    results = _run_tiles(_tile_clusters, tasks, n_workers)
+
+    # Merge clusters that straddle tile boundaries
+    i = np.concatenate([r[0] for r in results])
+    j = np.concatenate([r[1] for r in results])
+    return _canonical(_components(n, i, j))
+
+
+def make_tiled_blobs(xy, labels, buffer_radius, tile_size=None, n_workers=1):
+    '''
+    Blob polygons for clustered endpoints, built per tile (each blob in the
+    tile of its first endpoint).
+
+    Returns
+    -------
+    GeoSeries of blob polygons indexed by blob label
+
+    '''
+
+    n_blobs = labels.max() + 1 if len(labels) else 0
+    if tile_size is None:
+        tasks = [(labels, xy, buffer_radius)]
+    else:
+        _, first = np.unique(labels, return_index=True)
+        blob_tile = np.floor(xy[first]/tile_size).astype(np.int64)
+        _, tile_of_blob = np.unique(blob_tile, axis=0, return_inverse=True)
+        point_tile = tile_of_blob.ravel()[labels]
+        order = np.argsort(point_tile, kind='stable')
+        _, start = np.unique(point_tile[order], return_index=True)
+        tasks = ((labels[g], xy[g], buffer_radius) for g in np.split(order, start[1:]))
+    results = _run_tiles(_tile_blobs, tasks, n_workers)
+
+    blobs = np.empty(n_blobs, dtype=object)
+    for uniq, polys in results:
+        blobs[uniq] = polys
+    return geopandas.GeoSeries(blobs)
+
+
+def reference_ids(blob_geom, reference):
+    '''
+    Ids of the reference blobs matching each blob.
+
+    Parameters
+    ----------
+    blob_geom : GeoSeries
+        Blob polygons (make_tiled_blobs output)
+    reference : GeoDataFrame or GeoSeries
+        Blob layer whose index provides the ids, e.g. make_blobs output for
+        the same lines and buffer radius (each blob must fall in a different
+        reference blob)
+
+    Returns
+    -------
+    numpy.ndarray of ids. Blobs not found in the reference get new ids
+    after the largest reference id.
+
+    '''
+
+    pts = shapely.point_on_surface(blob_geom.values)
+    i, j = reference.sindex.query(pts, predicate='within')
+    ids = np.full(len(blob_geom), -1, dtype=np.int64)
+    ids[i] = reference.index.to_numpy()[j]
+    missing = ids < 0
+    start = reference.index.max() + 1 if len(reference) else 0
+    ids[missing] = start + np.arange(missing.sum())
+    return ids
+
+
+def build_graph(chunks, buffer_radius, tile_size=None, n_workers=1, crs=None,
+                keep_geometry=False, reference=None):
+    '''
+    Electrical graph from line sections, one node per blob and one edge per
+    line. With tile_size set, clustering and blob building run tile by tile
+    on a process pool; the result does not depend on the tile size.
+
+    Parameters
+    ----------
+    chunks : GeoDataFrame or iterable of GeoDataFrame
+        Line sections in a projected CRS (see read_endpoints)
+    buffer_radius : float
+        Same meaning as in make_blobs
+    tile_size : float, optional
+        Tile edge length (meters); must exceed 2*buffer_radius
+    n_workers : int
+        Worker processes
+    crs : str, optional
+        CRS of the blob layer returned alongside the graph
+    keep_geometry : bool
+        Keep LineStrings as the edge 'geometry' attribute
+    reference : GeoDataFrame or GeoSeries, optional
+        Blob layer (e.g. make_blobs output from an earlier single-pass run)
+        whose ids are given to the matching blobs, see reference_ids.
+        By default blobs are numbered by their lowest endpoint index.
+
+    Returns
+    -------
+    (G, blobs): networkx.Graph with the node and edge attributes used by
+    tree_builder (kv, phases, inservice, pos, blob / weight, length,
+    section_id, objectid, node_id), and a GeoDataFrame of the blobs
+    indexed by node id
+
+    '''
+
+    xy, sections = read_endpoints(chunks, keep_geometry=keep_geometry)
+    labels = cluster_endpoints(xy, buffer_radius, tile_size, n_workers)
+    blob_geom = make_tiled_blobs(xy, labels, buffer_radius, tile_size, n_workers)
+
+    ids = np.arange(len(blob_geom))
+    if reference is not None:
+        ids = reference_ids(blob_geom, reference)
+
+    blobs = geopandas.GeoDataFrame({'blob_idx': ids}, index=ids,
+                                   geometry=blob_geom.values, crs=crs)
+    blobs = blobs.sort_index()
+    pos = shapely.get_coordinates(shapely.point_on_surface(blobs.geometry.values))
+
+    G = nx.Graph()
+    G.add_nodes_from((b, dict(kv=16, phases=3, inservice=True, pos=tuple(p), blob=geom))
+                     for b, p, geom in zip(blobs.index.tolist(), pos, blobs.geometry.values))
+
+    L = len(sections)
+    u, v = ids[labels[:L]], ids[labels[L:]]
+    length = sections.get('SHAPE__Length', pd.Series(None, index=sections.index))
+    attrs = pd.DataFrame({'weight': length,
+                          'length': length,
+                          'section_id': sections.index,
+                          'objectid': sections.get('objectid'),
+                          'node_id': sections.get('node_id')},
+                         index=sections.index)
+    if keep_geometry:
+        attrs['geometry'] = sections[sections.columns[-1]]
+    G.add_edges_from(zip(u.tolist(), v.tolist(), attrs.to_dict('records')))
+
+    return G, blobs
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+topology_index.py
+
+Precomputed query index over the derived feeder graph, for screening many
+interconnection requests without repeated NetworkX path searches.
+
+The index is built once from a graph (e.g. professor_graph.pickle) and then
+answers, for arrays of points or nodes:
+    - nearest electrical node          (spatial index, O(log n))
+    - distance/depth to the substation (O(1))
+    - lowest common ancestor, distance (binary lifting, O(log n))
+    - downstream nodes and sections    (Euler-tour interval, O(1) to locate)
+
+"""
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+import geopandas
+
+
+class TopologyIndex:
+    '''
+    Query index over a (mostly radial) electrical graph.
+
+    Each connected component is rooted, and a spanning tree is taken by
+    breadth-first search from that root. Self-loops and any redundant edges
+    left by manual contractions are ignored by the tree structure.
+
+    Node ids are stored as given; internally every node has a position
+    0..n-1 in the arrays below.
+
+    Attributes
+    ----------
+    nodes : numpy.ndarray
+        Node id at each internal position
+    parent : numpy.ndarray
+        Internal position of each node's parent, -1 for component roots
+    depth : numpy.ndarray
+        Number of edges between each node and its component root
+    dist : numpy.ndarray
+        Cumulative edge 'length' between each node and its component root
+    tin, tout : numpy.ndarray
+        Euler-tour interval; the subtree of node i is order[tin[i]:tout[i]]
+    order : numpy.ndarray
+        Internal positions in DFS preorder
+    parent_section : numpy.ndarray
+        section_id of the edge from each node to its parent (-1 for roots)
+
+    '''
+
+    def __init__(self, G, root, crs="EPSG:2955", weight='length'):
+        '''
+        Parameters
+        ----------
+        G : networkx.Graph
+            Electrical graph, with 'pos' node attributes (as in tree_builder)
+        root : node id or shapely.Point
+            The substation node, or a point whose nearest node is used.
+            Components not containing the root are rooted at the node
+            nearest to the root's position.
+        crs : str
+            CRS of the 'pos' coordinates
+        weight : str
+            Edge attribute used for distances
+
+        '''
+
+        self.crs = crs
+        pos = nx.get_node_attributes(G, 'pos')
+        self.nodes = np.array(list(pos.keys()))
+        self._loc = pd.Series(np.arange(len(self.nodes)), index=self.nodes)
+        x, y = [np.asarray(c, dtype=float) for c in zip(*pos.values())]
+        self.xy = np.column_stack([x, y])
+
+        # Spatial index on node positions
+        self.points = geopandas.GeoSeries.from_xy(x, y, crs=crs)
+        self.sindex = self.points.sindex
+
+        if not G.has_node(root):
+            root = self.nodes[self.sindex.nearest(root)[1][0]]
+        self.root = root
+        root_xy = self.xy[self._loc[root]]
+
+        n = len(self.nodes)
+        self.parent = np.full(n, -1, dtype=np.int64)
+        self.depth = np.zeros(n, dtype=np.int64)
+        self.dist = np.zeros(n, dtype=float)
+        self.component = np.zeros(n, dtype=np.int64)
+        self.parent_section = np.full(n, -1, dtype=np.int64)
+        self.tin = np.zeros(n, dtype=np.int64)
+        self.tout = np.zeros(n, dtype=np.int64)
+        size = np.ones(n, dtype=np.int64)
+        order = []
+
+        # Root each component, then walk its BFS tree
+        comps = sorted(nx.connected_components(G),
+                       key=lambda c: root not in c)
+        for ci, comp in enumerate(comps):
+            members = self._loc[list(comp)].to_numpy()
+            if root in comp:
+                croot = root
+            else:
+                d2 = ((self.xy[members] - root_xy)**2).sum(axis=1)
+                croot = self.nodes[members[np.argmin(d2)]]
+
+            T = nx.bfs_tree(G, croot)
+            for u, v in T.edges: # BFS order, so parents come first
+                iu, iv = self._loc[u], self._loc[v]
+                data = G.edges[u, v]
+                self.parent[iv] = iu
+                self.depth[iv] = self.depth[iu] + 1
+                self.dist[iv] = self.dist[iu] + data.get(weight, 1.0)
+                self.parent_section[iv] = data.get('section_id', -1)
+            self.component[members] = ci
+
+            # Euler tour: preorder position and subtree size
+            pre = self._loc[list(nx.dfs_preorder_nodes(T, croot))].to_numpy()
+            self.tin[pre] = len(order) + np.arange(len(pre))
+            for iv in pre[::-1][:-1]:
+                size[self.parent[iv]] += size[iv]
+            self.tout[pre] = self.tin[pre] + size[pre]
+            order.extend(pre)
+
+        self.order = np.asarray(order, dtype=np.int64)
+
+        # Binary lifting table; roots point to themselves
+        up0 = np.where(self.parent < 0, np.arange(n), self.parent)
+        self.up = [up0]
+        for _ in range(max(int(self.depth.max()).bit_length(), 1) - 1):
+            self.up.append(self.up[-1][self.up[-1]])
+
+
+    def _idx(self, nodes):
+        return self._loc[np.atleast_1d(nodes)].to_numpy()
+
+
+    def nearest_node(self, x, y, latlon=False, return_distance=False):
+        '''
+        Nearest electrical node to each point.
+
+        Parameters
+        ----------
+        x, y : float or array-like
+            Point coordinates in the index CRS, or (latitude, longitude)
+            if latlon=True
+        latlon : bool
+            Treat x, y as latitude/longitude (EPSG:4326)
+        return_distance : bool
+            Also return the snap distance (in CRS units)
+
+        Returns
+        -------
+        numpy.ndarray of node ids (and distances if requested)
+
+        '''
+
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        if latlon:
+            pts = geopandas.GeoSeries.from_xy(y, x, crs="EPSG:4326").to_crs(self.crs)
+        else:
+            pts = geopandas.GeoSeries.from_xy(x, y, crs=self.crs)
+
+        idx, d = self.sindex.nearest(pts, return_all=False, return_distance=True)
+        near = np.empty(len(pts), dtype=np.int64)
+        dist = np.empty(len(pts), dtype=float)
+        near[idx[0]] = idx[1]
+        dist[idx[0]] = d
+        if return_distance:
+            return self.nodes[near], dist
+        return self.nodes[near]
+
+
+    def distance_to_root(self, nodes):
+        '''Cumulative line length from each node to its component root'''
+        return self.dist[self._idx(nodes)]
+
+
+    def connected_to_root(self, nodes):
+        '''True where the node lies in the same component as the substation'''
+        return self.component[self._idx(nodes)] == 0
+
+
+    def lca(self, u, v):
+        '''
+        Lowest common ancestor of node arrays u and v (pairwise).
+        Returns -1 where u and v are in different components.
+        '''
+
+        a, b = self._idx(u), self._idx(v)
+        swap = self.depth[a] < self.depth[b]
+        a, b = np.where(swap, b, a), np.where(swap, a, b)
+
+        # lift a to the depth of b
+        diff = self.depth[a] - self.depth[b]
+        for k, up in enumerate(self.up):
+            step = (diff >> k) & 1 == 1
+            a = np.where(step, up[a], a)
+
+        # lift both to just below their common ancestor
+        for up in reversed(self.up):
+            move = up[a] != up[b]
+            a = np.where(move, up[a], a)
+            b = np.where(move, up[b], b)
+        anc = np.where(a == b, a, self.up[0][a])
+
+        same = self.component[a] == self.component[b]
+        return np.where(same, self.nodes[anc], -1)
+
+
+    def distance(self, u, v):
+        '''Network distance between node arrays u and v (inf if disconnected)'''
+        a, b = self._idx(u), self._idx(v)
+        anc = self.lca(u, v)
+        ok = anc != -1
+        d = np.full(len(a), np.inf)
+        d[ok] = (self.dist[a[ok]] + self.dist[b[ok]]
+                 - 2*self.dist[self._idx(anc[ok])])
+        return d
+
+
+    def is_downstream(self, nodes, of):
+        '''True where nodes[i] is in the subtree of of[i] (inclusive)'''
+        a, b = self._idx(nodes), self._idx(of)
+        return (self.tin[b] <= self.tin[a]) & (self.tin[a] < self.tout[b])
+
+
+    def n_downstream(self, nodes):
+        '''Number of nodes in each subtree, including the node itself'''
+        i = self._idx(nodes)
+        return self.tout[i] - self.tin[i]
+
+
+    def downstream_nodes(self, node):
+        '''Node ids downstream of (and including) node'''
+        i = self._loc[node]
+        return self.nodes[self.order[self.tin[i]:self.tout[i]]]
+
+
+    def downstream_sections(self, node):
+        '''section_id of every line section downstream of node'''
+        i = self._loc[node]
+        return self.parent_section[self.order[self.tin[i]+1:self.tout[i]]]
+
+
+    def path_to_root(self, node):
+        '''Node ids from node up to its component root'''
+        path = [self._loc[node]]
+        while self.parent[path[-1]] >= 0:
+            path.append(self.parent[path[-1]])
+        return self.nodes[path]
+
+
+    def sections_to_root(self, node):
+        '''section_id of each line section between node and its root'''
+        path = self._loc[self.path_to_root(node)].to_numpy()
+        return self.parent_section[path[:-1]]
+
+
+    def screen(self, x, y, latlon=False):
+        '''
+        Batch screening of interconnection points.
+
+        Parameters
+        ----------
+        x, y : array-like
+            Point coordinates (see nearest_node)
+        latlon : bool
+            Treat x, y as latitude/longitude
+
+        Returns
+        -------
+        pandas.DataFrame with one row per point: nearest node, snap distance,
+        distance and depth to the substation, whether the node is connected
+        to the substation, and the number of downstream nodes
+
+        '''
+
+        node, snap = self.nearest_node(x, y, latlon=latlon, return_distance=True)
+        i = self._idx(node)
+        return pd.DataFrame({'node': node,
+                             'snap_dist': snap,
+                             'dist_to_root': self.dist[i],
+                             'depth': self.depth[i],
+                             'connected': self.component[i] == 0,
+                             'n_downstream': self.tout[i] - self.tin[i]})
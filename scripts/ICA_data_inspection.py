@@ -16,10 +16,14 @@ import folium
 from shapely.geometry import Point
 import chardet
 
-from mvprofessor.config import raw_data_dir, int_data_dir
+from mvprofessor.config import raw_data_dir, int_data_dir, maps_dir
 from mvprofessor.custom_funcs import get_endpoints, make_blobs
+import mvprofessor.ica_constraints as icac
+from mvprofessor.map_export import ica_timeseries, export_timeseries_map
 
 phrs = pd.read_pickle(int_data_dir/'Prof_ICA_data.pkl')
+month_str = ['Jan','Feb','Mar','Apr','May','Jun',
+             'Jul','Aug','Sep','Oct','Nov','Dec']
 
 #%%
 # Compare node ids between ICA hourly data and the topology graph
@@ -50,6 +54,24 @@ gdf['vr'] = 0
 gdf.loc[gdf['node_id'].isin(vr_hasICA),'vr']=1
 
 
+#%% Binding constraints
+# For every node, month, hour and profile: which constraint sets the hosting
+# capacity, and how far the next constraint is above it
+gen_binding = icac.classify_binding(phrs, icac.GEN_METRICS)
+load_binding = icac.classify_binding(phrs, icac.LOAD_METRICS)
+
+# share of hours each constraint binds, per node and profile
+gen_share = icac.binding_share(gen_binding, by=['Node_ID','Load_Profile_Type'])
+load_share = icac.binding_share(load_binding, by=['Node_ID','Load_Profile_Type'])
+
+# margin statistics and most frequent constraint, per node
+gen_summary = icac.binding_summary(gen_binding)
+gen_dominant = icac.dominant_constraint(gen_binding)
+
+gen_share.to_pickle(int_data_dir / 'Prof_ICA_gen_binding_share.pkl')
+load_share.to_pickle(int_data_dir / 'Prof_ICA_load_binding_share.pkl')
+
+
 #%% Plot the nodes with/without ICA data, 
 # as well as nodes potential benefitting from voltage regulation
 lgd_txt = '<span style="color: {col};">{txt}</span>'
@@ -69,6 +91,16 @@ folium.LayerControl().add_to(m)
 m.save('nodes_ICA_data.html')
 
 
+#%% Time-series map: every month and hour on one page
+# Geometry is written once; the 12x24 values per section are a binary array
+# that the viewer switches between client-side
+field = 'Voltage_Fluctuation_(kW)'
+ts = ica_timeseries(phrs, field, profile='MIN')
+ts_labels = ['{} {:02d}:00'.format(month_str[m-1], h) for m,h in ts.columns]
+export_timeseries_map(maps_dir / 'ICA_timeseries', gdf, ts.reindex(gdf['node_id']),
+                      labels=ts_labels, value_name=field.replace('_',' '))
+
+
 #%% Plot the 12 months for a given node
 # sample 12 colors from 'twilight', a diverging colormap.
 # The idea is to highlight the summer months, when we expect max constraint
@@ -77,8 +109,6 @@ twil = cm.get_cmap('twilight', 12)
 
 node = vr_nodes[0] # pick a random node from VR candidates
 months = np.arange(1,13,1)
-month_str = ['Jan','Feb','Mar','Apr','May','Jun',
-             'Jul','Aug','Sep','Oct','Nov','Dec']
 
 field = 'Voltage_Fluctuation_(kW)'
 mm = 'MIN' # min or max
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+check_tiled_build.py
+
+Compare the tiled build (tiled_build.build_graph) with the single-pass
+make_blobs -> tree_builder pipeline of network_grapher.py on the Professor
+feeder. Run it after changes to tiled_build.py; it is not part of the
+pipeline.
+
+The tiled graph is numbered after the single-pass blobs (reference=...), so
+the two graphs should have the same nodes, and the same line section between
+the same pair of nodes, at any tile size.
+
+"""
+
+#%%
+import pandas as pd
+
+from mvprofessor.config import int_data_dir
+import mvprofessor.custom_funcs as mvpf
+import mvprofessor.tiled_build as tiled_build
+
+r = 7 # buffer radius, as in network_grapher.py
+
+poi = pd.read_pickle(int_data_dir/'PoI_Professor.pkl')
+isla_vista = poi.loc[poi['PoI']=='isla_vista_ss']['geometry'].iloc[0]
+
+gdf = pd.read_pickle(int_data_dir/'professor.pkl')
+gdf = gdf[gdf['SHAPE__Length'] > 30]
+
+#%% Single pass
+blobs = mvpf.make_blobs(mvpf.get_endpoints(gdf), r)
+reference = blobs.copy()
+blobs['powered'] = 0
+G = mvpf.tree_builder(gdf.copy(), blobs, isla_vista)
+
+def edge_set(G):
+    return {(frozenset((u, v)), d['section_id']) for u, v, d in G.edges(data=True)}
+
+#%% Tiled, at tile sizes just above 2r and 4r (a point's overlap margin then
+# spans two or three tiles per axis), and a large one
+for tile_size in [2*r + 0.01, 4*r + 0.01, 500]:
+    T, tblobs = tiled_build.build_graph(gdf, r, tile_size=tile_size, n_workers=2,
+                                        crs=gdf.crs, reference=reference)
+    area = max((a ^ b).area for a, b in zip(tblobs.geometry, reference.geometry))
+    print('tile_size={}: same nodes {}, same edges {}, max blob difference {:.2g} m2'.format(
+        tile_size, set(T.nodes) == set(G.nodes), edge_set(T) == edge_set(G), area))
@@ -23,8 +23,10 @@ from shapely.geometry import Point, LineString
 from geographiclib.geodesic import Geodesic
 import pickle
 
-from mvprofessor.config import int_data_dir, maps_dir
+from mvprofessor.config import raw_data_dir, int_data_dir, maps_dir
 import mvprofessor.custom_funcs as mvpf
+import mvprofessor.ica_join as ica_join
+import mvprofessor.tiled_build as tiled_build
 
 # *****************************
 # Layer 0: Points of Interest 
@@ -46,8 +48,23 @@ pts = mvpf.get_endpoints(gdf)
 # *****************************
 # Layer 3: Blobs
 # *****************************
-blobs = mvpf.make_blobs(pts,7)
-blobs['powered'] = 0
+# TILE_SIZE = None builds the blobs and the graph in one pass. For layers too
+# large for that, set a tile size in meters (> 2x the buffer radius) to build
+# them tile by tile with tiled_build. The tiled build numbers its blobs after
+# the blobs.pkl saved by the last single-pass run, so that the manual
+# contractions below still name the same nodes.
+TILE_SIZE = None
+N_WORKERS = 4
+
+if TILE_SIZE is None:
+    blobs = mvpf.make_blobs(pts,7)
+    blobs.to_pickle(int_data_dir / 'blobs.pkl')
+    blobs['powered'] = 0
+else:
+    G, blobs = tiled_build.build_graph(gdf, 7, tile_size=TILE_SIZE,
+                                       n_workers=N_WORKERS, crs=gdf.crs,
+                                       keep_geometry=True,
+                                       reference=pd.read_pickle(int_data_dir / 'blobs.pkl'))
 
 
 #%% Define a shapely.Point as the desired starting point
@@ -55,8 +72,9 @@ blobs['powered'] = 0
 isla_vista = poi.loc[poi['PoI']=='isla_vista_ss']['geometry']
 isla_vista = isla_vista.iloc[0]
 
-#%% Run the tree builder algorithm
-G = mvpf.tree_builder(gdf,blobs,isla_vista)
+#%% Run the tree builder algorithm (the tiled build already made G)
+if TILE_SIZE is None:
+    G = mvpf.tree_builder(gdf,blobs,isla_vista)
 
 #%% Make Enodes, flagged by their subgraph
 enodes = mvpf.make_enodes(G)
@@ -109,6 +127,13 @@ for p in pairs:
 # Manually remove any erronous edges
 #G.remove_edge(74,119)
 
+#%% Replace the placeholder kv/phases with ICA_Layer attributes
+# Sections are matched to ICA segments by geometry overlap, then the
+# phase, voltage, and hosting capacity are written to every edge and node
+ica = ica_join.load_ica_layer(raw_data_dir / 'ICA_Layer.geojson', circuit='Professor')
+ica_matched = ica_join.match_sections(gdf, ica)
+G = ica_join.apply_ica_attributes(G, ica_matched)
+
 # save graph object to file
 pickle.dump(G, open(int_data_dir / 'professor_graph.pickle', 'wb'))
 
@@ -117,8 +142,9 @@ enodes = mvpf.make_enodes(G)
 
 # *****************************
 # Layer 4: Electrical Nodes (enodes)
-# second pass
+# second pass, with ICA attributes
 # *****************************
+enodes = enodes.join(ica_join.node_attribute_table(G))
 enodes.to_pickle(int_data_dir / 'enodes.pkl')
     
 #%% Focus on the subgraph around Goleta City Hall/ Karl Storz ("CHKS")
@@ -142,7 +168,7 @@ sedge_df = nx.to_pandas_edgelist(S[sx])
 # *****************************
 enodes_chks = enodes[enodes.subgraph==sx]
 chks_lines = geopandas.GeoDataFrame(sedge_df,geometry=sedge_df['geometry'],crs="EPSG:2955")
-chks_lines = chks_lines.drop('branch',axis=1)
+chks_lines = chks_lines.drop(columns='branch', errors='ignore') # tiled builds have no 'branch'
 chks_lines.to_pickle(int_data_dir / 'CHKS_lines.pkl')
 
 # *****************************
@@ -17,15 +17,18 @@ from geographiclib.geodesic import Geodesic
 
 # Custom components
 from mvprofessor.config import raw_data_dir, int_data_dir
+from mvprofessor.geojson_stream import read_geojson
 
 #%%
-gdf = geopandas.read_file(raw_data_dir / 'professor.geojson')
+# Stream the features, keeping only columns which change (others cols are
+# the same for every row). Unlike geopandas.read_file, the dropped columns
+# are never held in memory, so this also works for system-wide exports.
+gdf = read_geojson(raw_data_dir / 'professor.geojson',
+                   columns=['section_id','SHAPE__Length','objectid','node_id'],
+                   circuit='Professor')
 
 gdf=gdf.set_index('section_id')
 
-# retain only columns which change (others cols are the same for every row)
-gdf=gdf[["SHAPE__Length","objectid","node_id","geometry"]]
-
 gdf['node_id'] =gdf['node_id'].apply(lambda x: int(x))
 
 # add random number to make each LineString a different color when mapping